@@ -15,7 +15,7 @@ from nni.compression.pytorch.utils.mask_conflict import fix_mask_conflict
 from nni.compression.pytorch.utils.utils import get_module_by_name
 from .compress_modules import replace_module
 from .infer_mask import AutoMaskInference
-from .jit_translate import jit_to_python_function
+from .jit_translate import fold_constants, jit_to_python_function
 from ..utils import rand_like_with_shape
 
 
@@ -91,6 +91,19 @@ class ModelSpeedup:
         self.constant = {}
         # self.internal_result save the internal output of the submodules
         self.internal_result = {}
+        # self.const_cache save the values evaluated from the constant subgraphs
+        # by parse_constant, the key is the debug name of the value
+        self.const_cache = {}
+        # self.debug_names and self.ivalues save the debugName() and toIValue()
+        # of the torch._C.Values, the key is the value itself
+        self.debug_names = {}
+        self.ivalues = {}
+        # self.translation_cache save the translated functions that are shared
+        # by the identical stateless nodes, see jit_to_python_function
+        self.translation_cache = {}
+        # self.folded_nodes save the unique names of the nodes evaluated by
+        # fold_constants, these nodes are skipped in the mask inference
+        self.folded_nodes = set()
         self.customized_replace_func = customized_replace_func if customized_replace_func is not None else {}
 
     def _random_model_input(self, dummy_input, confidence, batch_dim):
@@ -373,16 +386,22 @@ class ModelSpeedup:
             in_degree[node.unique_name] = len(predecessors)
             if in_degree[node.unique_name] == 0:
                 visit_queue.put(node)
-        # Forward mask inference
+        # sort the nodes in the topological order
+        topo_order = []
         while not visit_queue.empty():
             curnode = visit_queue.get()
-            # forward mask inference for curnode
-            self.update_direct_sparsity(curnode)
+            topo_order.append(curnode)
             successors = self.torch_graph.find_successors(curnode.unique_name)
             for successor in successors:
                 in_degree[successor] -= 1
                 if in_degree[successor] == 0:
                     visit_queue.put(self.torch_graph.name_to_node[successor])
+        # evaluate the constant shape-arithmetic nodes in advance
+        fold_constants(topo_order, self)
+        # Forward mask inference
+        for curnode in topo_order:
+            # forward mask inference for curnode
+            self.update_direct_sparsity(curnode)
         # backward mask inference
         for unique_name in out_degree:
             if out_degree[unique_name] == 0:
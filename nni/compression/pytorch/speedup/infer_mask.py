@@ -195,7 +195,8 @@ class AutoMaskInference:
                 if para in self.weight_mask:
                     self.weights[para].data *= self.weight_mask[para].data
 
-    def isconstants(self, tout):
+    @staticmethod
+    def isconstants(tout):
         """
         Find the constants in the tensor tout. This function return a mask tensor that
         indicates if a value in tout is a constant, and return one more tensor to indicate
@@ -4,19 +4,27 @@
 import re
 import logging
 from functools import partial
-import copy
 import torch
 
+from .infer_mask import AutoMaskInference
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-jitid_2_dtype = {4: torch.long, 6:torch.float32}
+# the dtypes indexed by their scalar type ids in the jit graph, the order
+# follows the c10::ScalarType enum
+jitid_2_dtype = (torch.uint8, torch.int8, torch.int16, torch.int32,
+                 torch.long, torch.float16, torch.float32, torch.float64)
+# the patterns used to parse the attributes of prim:: nodes from their
+# string representations, compiled once at import time
+_GETATTR_NAME_RE = re.compile(r'\[name=\"(.*?)\"\]')
+_CONSTANT_VALUE_RE = re.compile(r'\[value=(.*?)\]')
 
 # to exclude partial
 
 __all__ = [
     'adaptive_avgpool_python', 'add_python', 'avgpool2d_python', 'cat_python', 'contiguous_python',
-    'div_python', 'dropout_python', 'exp_python', 'flatten_python', 'floor_div_python', 'gelu_python',
+    'div_python', 'dropout_python', 'exp_python', 'flatten_python', 'floor_div_python', 'fold_constants', 'gelu_python',
     'getattr_python', 'jit_to_python_function', 'matmul_python', 'mean_python',
     'mul_python', 'num2tensor_python', 'parse_constant', 'permute_python', 'relu_inplace_python',
     'relu_python', 'reshape_python', 'select_python', 'sigmoid_python', 'size_python', 'slice_python',
@@ -26,6 +34,60 @@ __all__ = [
 ]
 
 
+def _inputs(node):
+    """
+    Get the input values of the key cpp node of the target node. The list
+    is cached on the node, so the C++ input iterator is only walked once
+    no matter how many times the node is translated.
+
+    Parameters
+    ----------
+    node: NodePyGroup
+        The target node.
+
+    Returns
+    -------
+    inputs: list of torch._C.Value
+        The inputs of the key cpp node.
+    """
+    inputs = getattr(node, '_nni_inputs', None)
+    if inputs is None:
+        inputs = list(node.key_node.inputs())
+        node._nni_inputs = inputs
+    return inputs
+
+
+def _debug_name(value, speedup):
+    """
+    Get the debugName of the torch._C.Value. The names are cached on the speedup
+    object, so each value only crosses the python/C++ boundary once.
+    """
+    if speedup is None:
+        return value.debugName()
+    cache = speedup.debug_names
+    # the cache holds the reference of the value, so the key cannot be
+    # taken by another value after the original one is garbage collected
+    name = cache.get(value)
+    if name is None:
+        name = cache[value] = value.debugName()
+    return name
+
+
+def _ivalue(value, speedup):
+    """
+    Get the toIValue of the torch._C.Value, cached on the speedup object
+    the same way as _debug_name.
+    """
+    if speedup is None:
+        return value.toIValue()
+    cache = speedup.ivalues
+    try:
+        return cache[value]
+    except KeyError:
+        ivalue = cache[value] = value.toIValue()
+        return ivalue
+
+
 def translate_list(list_node, speedup=None):
     """
     Get the list of values from the list construct node.
@@ -45,17 +107,35 @@ def translate_list(list_node, speedup=None):
     # the node that create the list
     create_node = list_node.node()
     assert create_node.kind() == 'prim::ListConstruct'
-    inputs = list(create_node.inputs())
     values = []
-    for _i in inputs:
-        debugName = _i.debugName()
+    # the values of the gpu tensors are fetched in batches after the loop,
+    # so that we only synchronize with each device once
+    cuda_entries = []
+    for _i in create_node.inputs():
+        debugName = _debug_name(_i, speedup)
         if speedup is not None and debugName in speedup.internal_result:
             # this value is the result of the other nodes, such as
             # ate::size
-            values.append(speedup.internal_result[debugName].item())
+            value = speedup.internal_result[debugName]
+            if value.is_cuda:
+                cuda_entries.append((len(values), value))
+                values.append(None)
+            else:
+                values.append(value.item())
         else:
             # if the corresponding value is a constant
-            values.append(_i.toIValue())
+            values.append(_ivalue(_i, speedup))
+    if cuda_entries:
+        # group the tensors by device and dtype, because torch.cat cannot
+        # concatenate across devices, and will promote the mixed dtypes,
+        # for example, turn the integer sizes into floats
+        groups = {}
+        for index, tensor in cuda_entries:
+            groups.setdefault((tensor.device, tensor.dtype), []).append((index, tensor))
+        for entries in groups.values():
+            packed = torch.cat([tensor.reshape(1) for _, tensor in entries]).cpu().tolist()
+            for (index, _), value in zip(entries, packed):
+                values[index] = value
     return values
 
 
@@ -75,18 +155,57 @@ def parse_constant(cvalue, speedup):
     value: int/float/tensor
         The constant values parsed from the node.
     """
-    logger.debug('Try to parse the constant value: %s', cvalue.debugName())
-    if cvalue.toIValue() is not None:
-        return cvalue.toIValue()
-    if cvalue.debugName() in speedup.internal_result:
-        return speedup.internal_result[cvalue.debugName()]
-    # Get the operator node of the this value
-    op_node = cvalue.node()
-
-    inputs = op_node.inputs()
-    input_values = [parse_constant(_i, speedup) for _i in inputs]
-    func = trans_from_jit_to_python[op_node.kind()](op_node, speedup)
-    return func(*input_values)
+    logger.debug('Try to parse the constant value: %s', _debug_name(cvalue, speedup))
+    ivalue = _ivalue(cvalue, speedup)
+    if ivalue is not None:
+        return ivalue
+    assert speedup is not None, 'Need the speedup object to parse the non-constant value'
+    debug_name = _debug_name(cvalue, speedup)
+    if debug_name in speedup.internal_result:
+        return speedup.internal_result[debug_name]
+    # the values evaluated from the constant subgraphs, so that the shared
+    # subgraphs are only evaluated once in the whole speedup process
+    cache = speedup.const_cache
+    if debug_name in cache:
+        return cache[debug_name]
+
+    def _resolve(value):
+        # return (True, value) if the value is already known, else (False, None)
+        ivalue = _ivalue(value, speedup)
+        if ivalue is not None:
+            return True, ivalue
+        debug_name = _debug_name(value, speedup)
+        if debug_name in speedup.internal_result:
+            return True, speedup.internal_result[debug_name]
+        if debug_name in cache:
+            return True, cache[debug_name]
+        return False, None
+
+    # evaluate the subgraph in post-order with an explicit stack, so that
+    # deep graphs will not hit the recursion limit
+    stack = [(cvalue, False)]
+    while stack:
+        cur_value, expanded = stack.pop()
+        debug_name = _debug_name(cur_value, speedup)
+        if debug_name in cache:
+            continue
+        # Get the operator node of the this value
+        op_node = cur_value.node()
+        if not expanded:
+            stack.append((cur_value, True))
+            for _input in op_node.inputs():
+                if not _resolve(_input)[0]:
+                    stack.append((_input, False))
+            continue
+        input_values = [_resolve(_i)[1] for _i in op_node.inputs()]
+        trans_func = trans_from_jit_to_python.get(op_node.kind())
+        if trans_func is None:
+            logger.error('%s is not Supported! Cannot parse the constant value: %s', op_node.kind(), debug_name)
+            # None is a meaningful constant, so we cannot return it here
+            raise KeyError(op_node.kind())
+        func = trans_func(op_node, speedup)
+        cache[debug_name] = func(*input_values)
+    return cache[_debug_name(cvalue, speedup)]
 
 
 def dropout_python(node, speedup):
@@ -94,11 +213,12 @@ def dropout_python(node, speedup):
 
 
 def flatten_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    start_dim = inputs[1].toIValue()
-    end_dim = inputs[2].toIValue()
-    new_flatten = partial(torch.flatten, start_dim=start_dim, end_dim=end_dim)
+    inputs = _inputs(node)
+    start_dim = _ivalue(inputs[1], speedup)
+    end_dim = _ivalue(inputs[2], speedup)
+
+    def new_flatten(x):
+        return torch.flatten(x, start_dim, end_dim)
     return new_flatten
 
 
@@ -115,64 +235,60 @@ def sigmoid_python(node, speedup):
 
 
 def mean_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    dim_list = translate_list(inputs[1], speedup)
-    keep_dim = inputs[2].toIValue()
-    new_mean = partial(torch.mean, dim=tuple(dim_list), keepdim=keep_dim)
+    inputs = _inputs(node)
+    dim_list = tuple(translate_list(inputs[1], speedup))
+    keep_dim = _ivalue(inputs[2], speedup)
+
+    def new_mean(x):
+        return torch.mean(x, dim_list, keep_dim)
     return new_mean
 
 
 def add_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
+    internal_result = speedup.internal_result
+    input_0, input_1 = inputs[0], inputs[1]
     constant = None
-    for i in range(2):
-        input_i = inputs[i]
-        debug_name = input_i.debugName()
-        if debug_name not in speedup.internal_result:
-            # this input is a constant value
-            # TODO: what if this input is a constant tensor
-
-            if input_i.toIValue() is not None:
-                constant = parse_constant(input_i, speedup)
-                break
+    # one of the inputs may be a constant value
+    # TODO: what if this input is a constant tensor
+    if _debug_name(input_0, speedup) not in internal_result and _ivalue(input_0, speedup) is not None:
+        constant = parse_constant(input_0, speedup)
+    elif _debug_name(input_1, speedup) not in internal_result and _ivalue(input_1, speedup) is not None:
+        constant = parse_constant(input_1, speedup)
     if constant is None:
         return torch.add
     else:
-        new_add = partial(torch.add, constant)
+        def new_add(x):
+            return torch.add(constant, x)
         return new_add
 
 
 def sub_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    constant = [None, None]
-    for i in range(2):
-        input_i = inputs[i]
-        debug_name = input_i.debugName()
-        if debug_name not in speedup.internal_result:
-            # this input is a constant value
-            # TODO: what if this input is a constant tensor
-
-            if input_i.toIValue() is not None:
-                constant[i] = parse_constant(input_i, speedup)
-                break
-    if constant[0] is None and constant[1] is None:
-        new_sub = torch.sub
-    elif constant[0] is not None:
-        new_sub = partial(torch.sub, input=constant)
+    inputs = _inputs(node)
+    internal_result = speedup.internal_result
+    input_0, input_1 = inputs[0], inputs[1]
+    # one of the inputs may be a constant value
+    # TODO: what if this input is a constant tensor
+    if _debug_name(input_0, speedup) not in internal_result and _ivalue(input_0, speedup) is not None:
+        constant = parse_constant(input_0, speedup)
+
+        def new_sub(x):
+            return torch.sub(constant, x)
+    elif _debug_name(input_1, speedup) not in internal_result and _ivalue(input_1, speedup) is not None:
+        constant = parse_constant(input_1, speedup)
+
+        def new_sub(x):
+            return torch.sub(x, constant)
     else:
-        new_sub = partial(torch.sub, other=constant)
+        new_sub = torch.sub
     return new_sub
 
 
 def floor_div_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     divisor = inputs[1]
     constant = None
-    if divisor.debugName() not in speedup.internal_result:
+    if _debug_name(divisor, speedup) not in speedup.internal_result:
         # divisor is a constant value/tensor
         constant = parse_constant(divisor, speedup)
     if constant is None:
@@ -183,20 +299,20 @@ def floor_div_python(node, speedup):
 
 
 def mul_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
+    internal_result = speedup.internal_result
+    input_0, input_1 = inputs[0], inputs[1]
     constant = None
-    for i in range(2):
-        input_i = inputs[i]
-        debug_name = input_i.debugName()
-        if debug_name not in speedup.internal_result:
-            constant = parse_constant(input_i, speedup)
-            # both two inputs cannot be constants at the same time
-            break
+    # both two inputs cannot be constants at the same time
+    if _debug_name(input_0, speedup) not in internal_result and _ivalue(input_0, speedup) is not None:
+        constant = parse_constant(input_0, speedup)
+    elif _debug_name(input_1, speedup) not in internal_result and _ivalue(input_1, speedup) is not None:
+        constant = parse_constant(input_1, speedup)
     if constant is None:
         return torch.mul
     else:
-        new_mul = partial(torch.mul, constant)
+        def new_mul(x):
+            return torch.mul(constant, x)
         return new_mul
 
 
@@ -205,11 +321,12 @@ def transpose_python(node, speedup):
 
 
 def transpose2_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    dim_1 = inputs[1].toIValue()
-    dim_2 = inputs[2].toIValue()
-    new_transpose = partial(torch.transpose, dim0=dim_1, dim1=dim_2)
+    inputs = _inputs(node)
+    dim_1 = _ivalue(inputs[1], speedup)
+    dim_2 = _ivalue(inputs[2], speedup)
+
+    def new_transpose(x):
+        return torch.transpose(x, dim_1, dim_2)
     return new_transpose
 
 
@@ -221,32 +338,37 @@ def div_python(node, speedup):
     # The second input parameter of torch.div can be a
     # tensor or a constant, if it is a constant, we need
     # to return
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    if inputs[1].debugName() in speedup.internal_result:
+    inputs = _inputs(node)
+    if _debug_name(inputs[1], speedup) in speedup.internal_result:
         # the second input parameters is the output of the other
         # nodes
         return torch.div
     else:
-        other = inputs[1].toIValue()
-        new_div = partial(torch.div, other=other)
+        other = _ivalue(inputs[1], speedup)
 
+        def new_div(x):
+            return torch.div(x, other)
         return new_div
 
 
 def softmax_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    dim = inputs[1].toIValue()
-    new_softmax = partial(torch.softmax, dim=dim)
+    inputs = _inputs(node)
+    dim = _ivalue(inputs[1], speedup)
+
+    def new_softmax(x):
+        return torch.softmax(x, dim)
     return new_softmax
 
 
+class _ContiguousModule(torch.nn.Module):
+    def forward(self, x):
+        # always return a new tensor, the output must not alias the input,
+        # otherwise the gradients of the mask inference would be mixed up
+        return x.clone(memory_format=torch.contiguous_format)
+
+
 def contiguous_python(node, speedup):
-    class contiguousModule(torch.nn.Module):
-        def forward(self, x):
-            return x.contiguous().clone()
-    return contiguousModule()
+    return _ContiguousModule()
 
 
 def gelu_python(node, speedup):
@@ -258,19 +380,18 @@ def silu_python(node, speedup):
 
 
 def avgpool2d_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     kernel_size = translate_list(inputs[1], speedup)
     stride = translate_list(inputs[2], speedup)
     padding = translate_list(inputs[3], speedup)
-    new_avgpool = partial(torch.nn.functional.avg_pool2d,
-                          kernel_size=kernel_size, stride=stride, padding=padding)
+
+    def new_avgpool(x):
+        return torch.nn.functional.avg_pool2d(x, kernel_size, stride, padding)
     return new_avgpool
 
 
 def adaptive_avgpool_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     output_size = translate_list(inputs[1], speedup)
     new_avgpool = torch.nn.AdaptiveAvgPool2d(output_size)
     return new_avgpool
@@ -291,8 +412,7 @@ def exp_python(node, speedup):
 
 
 def squeeze_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     dim = None
     if len(inputs) > 1:
         dim = parse_constant(inputs[1], speedup)
@@ -301,20 +421,24 @@ def squeeze_python(node, speedup):
 
 
 def unsqueeze_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     dim = parse_constant(inputs[1], speedup)
     new_unsqueeze = partial(torch.unsqueeze, dim=dim)
     return new_unsqueeze
 
 def constant_pad_nd_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     pad = translate_list(inputs[1], speedup)
     value = parse_constant(inputs[2], speedup)
     new_constant_pad_nd = partial(torch.nn.functional.pad, pad=pad, value=value)
     return new_constant_pad_nd
 
+
+def _copy_bound(value):
+    # the bounds may be tensors returned by other nodes, such as aten::size
+    return value.clone() if isinstance(value, torch.Tensor) else value
+
+
 ##########################################################
 # Split Line
 # Following module/functions cannot be translated into a
@@ -323,27 +447,30 @@ def constant_pad_nd_python(node, speedup):
 ##########################################################
 
 
+class _SliceModule(torch.nn.Module):
+    def __init__(self, sliceobj):
+        super(_SliceModule, self).__init__()
+        # we need to copy the slice bounds here, because, in the
+        # follwing steps, we may randomize the input tensor
+        # which will change the values of the sliceobj. Only the
+        # tensor bounds need a real copy, ints/None are immutable
+        self.sliceobj = tuple(
+            slice(_copy_bound(s.start), _copy_bound(s.stop), _copy_bound(s.step))
+            if isinstance(s, slice) else _copy_bound(s) for s in sliceobj)
+
+    def forward(self, x, *args):
+        # args is for the slice dimension and indexes, however,
+        # we already get them from the cpp nodes. Note, though, we
+        # don't need the slice indexes any more, we cannot remove this
+        # parameter here, because, there may be multiple inputs passed from
+        # previous nodes such as aten::size
+        logger.info('Model has Slice operation, and the operand size=%s, Slice object:%s', str(
+            x.size()), str(self.sliceobj))
+        return x[self.sliceobj]
+
+
 def slice_python(node, speedup):
-    class SliceMoudle(torch.nn.Module):
-        def __init__(self, sliceobj):
-            super(SliceMoudle, self).__init__()
-            # we need to deepcopy the value here, because, in the
-            # follwing steps, we may randomize the input tensor
-            # which will change the values of the sliceobj
-            self.sliceobj = copy.deepcopy(sliceobj)
-
-        def forward(self, x, *args):
-            # args is for the slice dimension and indexes, however,
-            # we already get them from the cpp nodes. Note, though, we
-            # don't need the slice indexes any more, we cannot remove this
-            # parameter here, because, there may be multiple inputs passed from
-            # previous nodes such as aten::size
-            logger.info('Model has Slice operation, and the operand size=%s, Slice object:%s', str(
-                x.size()), str(self.sliceobj))
-            return x[self.sliceobj]
-
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
 
     slice_dim = parse_constant(inputs[1], speedup)
     slice_start = parse_constant(inputs[2], speedup)
@@ -357,7 +484,7 @@ def slice_python(node, speedup):
     logger.info('Slice dim:%s, Slice obj:%s', str(slice_dim), str(slice_obj))
     slice_list.append(slice_obj)
 
-    if inputs[0].debugName() not in speedup.internal_result:
+    if _debug_name(inputs[0], speedup) not in speedup.internal_result:
         # The inputs of slice operator may be the constant
         target_tensor = parse_constant(inputs[0], speedup)
         slice_list = tuple(slice_list)
@@ -366,92 +493,87 @@ def slice_python(node, speedup):
             return target_tensor[slice_list]
         return constant_slice
     else:
-        return SliceMoudle(tuple(slice_list))
+        return _SliceModule(tuple(slice_list))
 
 
 def select_python(node, speedup):
-    class SelectModule(torch.nn.Module):
-        def __init__(self, dim, index):
-            super(SelectModule, self).__init__()
-            self.dim = copy.deepcopy(dim)
-            self.index = copy.deepcopy(index)
+    inputs = _inputs(node)
+    dim = _ivalue(inputs[1], speedup)
+    index = _ivalue(inputs[2], speedup)
+
+    def select(x):
+        return x.select(dim, index)
+    return select
 
-        def forward(self, x):
-            return x.select(self.dim, self.index)
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    dim = inputs[1].toIValue()
-    index = inputs[2].toIValue()
-    return SelectModule(dim, index)
+
+class _SizeModule(torch.nn.Module):
+    def __init__(self, sizedim):
+        super(_SizeModule, self).__init__()
+        self.sizedim = sizedim
+        # the buffer is allocated once and filled in-place, so no python
+        # list is built for each forward
+        self._buf = torch.empty(1, dtype=torch.long)
+
+    def forward(self, x):
+        # return a copy, the output is kept in internal_result and passed
+        # to the successors, so it must not be refilled by the next forward
+        return self._buf.fill_(x.size(self.sizedim)).clone()
 
 
 def size_python(node, speedup):
     # return None
-    class SizeMoudle(torch.nn.Module):
-        def __init__(self, sizedim):
-            super(SizeMoudle, self).__init__()
-            self.sizedim = sizedim
-
-        def forward(self, x):
-            return torch.as_tensor([x.size(self.sizedim)], dtype=torch.long)
-            # return torch.tensor(x.size(self.sizedim))
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    size_dim = inputs[1].toIValue()
-    return SizeMoudle(size_dim)
+    inputs = _inputs(node)
+    size_dim = _ivalue(inputs[1], speedup)
+    return _SizeModule(size_dim)
 
 
 def toint_python(node, speedup):
-    class ToIntModule(torch.nn.Module):
-        def forward(self, x):
-            return x.to(torch.int)
-    return ToIntModule()
+    def toint(x):
+        return x.to(torch.int)
+    return toint
 
 
 def view_python(node, speedup):
-    class ViewModule(torch.nn.Module):
-        def __init__(self, shape):
-            super(ViewModule, self).__init__()
-            self.shape = shape
-            logger.info('View Module output size: %s', str(self.shape))
+    inputs = _inputs(node)
+    shape = tuple(translate_list(inputs[1], speedup))
+    logger.debug('Translate aten::view with the output size: %s', str(shape))
 
-        def forward(self, *args):
-            return args[0].view(self.shape)
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    shape = translate_list(inputs[1], speedup)
-    return ViewModule(shape)
+    def view(*args):
+        # the following args are the size values that already parsed into the shape
+        return args[0].view(shape)
+    return view
 
 
 def reshape_python(node, speedup):
-    class ReshapeModule(torch.nn.Module):
-        def __init__(self, shape):
-            super(ReshapeModule, self).__init__()
-            self.shape = shape
-            logger.info('Reshape Module output size: %s', str(self.shape))
+    inputs = _inputs(node)
+    shape = tuple(translate_list(inputs[1], speedup))
+    logger.debug('Translate aten::reshape with the output size: %s', str(shape))
 
-        def forward(self, *args):
-            return args[0].reshape(self.shape)
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    shape = translate_list(inputs[1], speedup)
-    return ReshapeModule(shape)
+    def reshape(*args):
+        # the following args are the size values that already parsed into the shape
+        return args[0].reshape(shape)
+    return reshape
 
 
 def permute_python(node, speedup):
-    class PermuteModule(torch.nn.Module):
-        def __init__(self, dimlist):
-            super(PermuteModule, self).__init__()
-            # deepcopy the values here, because the following randomize operation
-            # will change the value of the dimlist
-            self.dimlist = copy.deepcopy(dimlist)
+    inputs = _inputs(node)
+    # copy the values into a tuple here, because the following randomize
+    # operation will change the value of the dimlist
+    dim_list = tuple(translate_list(inputs[1], speedup))
+
+    def permute(x):
+        return x.permute(dim_list)
+    return permute
 
-        def forward(self, x):
-            return x.permute(self.dimlist)
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    dim_list = translate_list(inputs[1], speedup)
-    return PermuteModule(dim_list)
+
+class _GetModule(torch.nn.Module):
+    def __init__(self, key):
+        super(_GetModule, self).__init__()
+        self.key = key
+
+    def forward(self, obj):
+        logger.info('Get attribute: %s', self.key)
+        return getattr(obj, self.key)
 
 
 def getattr_python(node, speedup):
@@ -466,21 +588,21 @@ def getattr_python(node, speedup):
     speedup: ModelSpeedup
         The corresponding speedup object.
     """
-    class GetModule(torch.nn.Module):
-        def __init__(self, key):
-            super(GetModule, self).__init__()
-            self.key = key
-
-        def forward(self, obj):
-            logger.info('Get attribute: %s', self.key)
-            return getattr(obj, self.key)
     # get the name of the attribute, for example
     # prim::GetAttr[name="module_list"](%self.1)
     assert node.kind() == 'prim::GetAttr'
-    pattern = '\[name=\"(.*?)\"\]'
-    key_words = re.findall(pattern, str(node))
-    assert len(key_words) == 1
-    return GetModule(key_words[0])
+    match = _GETATTR_NAME_RE.search(str(node))
+    assert match is not None
+    return _GetModule(match.group(1))
+
+
+class _ConstantModule(torch.nn.Module):
+    def __init__(self, constant):
+        super(_ConstantModule, self).__init__()
+        self.constant = constant
+    def forward(self):
+        return self.constant
+
 
 def constant_python(node, speedup):
     """
@@ -493,21 +615,19 @@ def constant_python(node, speedup):
     speedup: ModelSpeedup
         The corresponding speedup object.
     """
-    class ConstantModule(torch.nn.Module):
-        def __init__(self, constant):
-            super(ConstantModule, self).__init__()
-            self.constant = constant
-        def forward(self):
-            return self.constant
-
     assert node.kind() == 'prim::Constant'
-    pattern = '\[value=(.*?)\]'
-    key_words = re.findall(pattern, str(node))
-    if len(key_words) == 0:
-        return ConstantModule(None)
-    assert len(key_words) == 1
+    try:
+        # toIValue directly returns the typed python value (int, float, str,
+        # torch.device, torch.dtype, tensor, None, ...) from the IR
+        return _ConstantModule(_ivalue(node.output(), speedup))
+    except RuntimeError as err:
+        logger.debug('Cannot convert the constant by toIValue: %s', err)
+    # fall back to parse the string representation of the node
+    match = _CONSTANT_VALUE_RE.search(str(node))
+    if match is None:
+        return _ConstantModule(None)
     # parse the constant value
-    value = key_words[0]
+    value = match.group(1)
     if value.startswith("\""):
         value = torch.device(value[1:-1])
     elif value.startswith('{'):
@@ -519,9 +639,13 @@ def constant_python(node, speedup):
     else:
         # integer value
         value = int(value)
-    return ConstantModule(value)
+    return _ConstantModule(value)
 
-def upsample_bilinear2d_python(node, speedup):
+def _make_upsample_python(upsample_func, scale_index):
+    """
+    Create the translate function of the upsample ops, they only differ in the
+    upsample function and the input index of the scale factors.
+    """
     class UpsampleModule(torch.nn.Module):
         def __init__(self, size_list, scale_list):
             super(UpsampleModule, self).__init__()
@@ -534,49 +658,34 @@ def upsample_bilinear2d_python(node, speedup):
             , the following parameters is useless, because we already
             get the size_list and the scale_list by parsing the cpp_nodes.
             """
-            return torch.nn.functional.upsample_bilinear(args[0],
-                                                         size=self.size_list, scale_factor=self.scale_list)
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    size_list_node = inputs[1].node()
-    scale_list_node = inputs[3].node()
-    size_list = None
-    scale_list = None
-
-    if size_list_node.kind() == 'prim::ListConstruct':
-        size_list = translate_list(inputs[1], speedup)
-    if scale_list_node.kind() == 'prim::ListConstruct':
-        scale_list = translate_list(inputs[3], speedup)
-    return UpsampleModule(size_list, scale_list)
-
-
-def upsample_nearest2d_python(node, speedup):
-    class UpsampleModule(torch.nn.Module):
-        def __init__(self, size_list, scale_list):
-            super(UpsampleModule, self).__init__()
-            self.size_list = size_list
-            self.scale_list = scale_list
+            return upsample_func(args[0], size=self.size_list, scale_factor=self.scale_list)
 
-        def forward(self, *args):
-            """
-            The first input of args is the target tensor to upsample
-            , the following parameters is useless, because we already
-            get the size_list and the scale_list by parsing the cpp_nodes.
-            """
-            return torch.nn.functional.upsample_nearest(args[0],
-                                                        size=self.size_list, scale_factor=self.scale_list)
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    size_list_node = inputs[1].node()
-    scale_list_node = inputs[2].node()
-    size_list = None
-    scale_list = None
-
-    if size_list_node.kind() == 'prim::ListConstruct':
-        size_list = translate_list(inputs[1], speedup)
-    if scale_list_node.kind() == 'prim::ListConstruct':
-        scale_list = translate_list(inputs[2], speedup)
-    return UpsampleModule(size_list, scale_list)
+    def upsample_python(node, speedup):
+        inputs = _inputs(node)
+        size_list_node = inputs[1].node()
+        scale_list_node = inputs[scale_index].node()
+        size_list = None
+        scale_list = None
+
+        if size_list_node.kind() == 'prim::ListConstruct':
+            size_list = translate_list(inputs[1], speedup)
+        if scale_list_node.kind() == 'prim::ListConstruct':
+            scale_list = translate_list(inputs[scale_index], speedup)
+        return UpsampleModule(size_list, scale_list)
+    return upsample_python
+
+
+upsample_bilinear2d_python = _make_upsample_python(torch.nn.functional.upsample_bilinear, 3)
+upsample_nearest2d_python = _make_upsample_python(torch.nn.functional.upsample_nearest, 2)
+
+
+class _TypeasModule(torch.nn.Module):
+    def __init__(self, dtype=torch.float):
+        super(_TypeasModule, self).__init__()
+        self.example = torch.zeros(1, dtype=dtype)
+
+    def forward(self, x):
+        return x.type_as(self.example)
 
 
 def typeas_python(node, speedup):
@@ -585,28 +694,22 @@ def typeas_python(node, speedup):
     TODO: support more types in the type_as, need to figure out
     how to get the scalar type from torch._C.TensorType.
     """
-    class TypeasModule(torch.nn.Module):
-        def __init__(self, dtype=torch.float):
-            self.example = torch.zeros(1, dtype=dtype)
+    return _TypeasModule()
 
-        def forward(self, x):
-            return x.type_as(self.example)
-    return TypeasModule()
+
+class _ToModule(torch.nn.Module):
+    def __init__(self, device, dtype):
+        super(_ToModule, self).__init__()
+        self.device = device
+        self.dtype = dtype
+    def forward(self, x):
+        return x.to(self.device, dtype=self.dtype)
 
 
 def to_python(node, speedup):
     # for the time being, only device parameters are supported
-    class ToModule(torch.nn.Module):
-        def __init__(self, device, dtype):
-            super(ToModule, self).__init__()
-            self.device = device
-            self.dtype = dtype
-        def forward(self, x):
-            return x.to(device, dtype=self.dtype)
-
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    in_debugname = inputs[0].debugName()
+    inputs = _inputs(node)
+    in_debugname = _debug_name(inputs[0], speedup)
     # device of the input tensor
     device = speedup.internal_result[in_debugname].device
 
@@ -615,72 +718,59 @@ def to_python(node, speedup):
         if isinstance(val, torch.device):
             device = val
     dtype = jitid_2_dtype[parse_constant(inputs[1], speedup)]
-    return ToModule(device, dtype)
+    return _ToModule(device, dtype)
 
 
-def cat_python(node, speedup):
-    class CatModule(torch.nn.Module):
-        def __init__(self, cat_dim):
-            super(CatModule, self).__init__()
-            self.cat_dim = cat_dim
+class _CatModule(torch.nn.Module):
+    def __init__(self, cat_dim):
+        super(_CatModule, self).__init__()
+        self.cat_dim = cat_dim
 
-        def forward(self, *args):
-            return torch.cat(args, dim=self.cat_dim)
+    def forward(self, *args):
+        return torch.cat(args, dim=self.cat_dim)
 
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    dim = inputs[1].toIValue()
-    return CatModule(dim)
+
+def cat_python(node, speedup):
+    inputs = _inputs(node)
+    dim = _ivalue(inputs[1], speedup)
+    return _CatModule(dim)
 
 
-def ones_python(node, speedup):
-    class OnesModule(torch.nn.Module):
+def _make_fill_python(fill_func):
+    """
+    Create the translate function of the ops that create a new tensor filled
+    with the same value, such as aten::ones and aten::zeros.
+    """
+    class FillModule(torch.nn.Module):
         def __init__(self, out_size, dtype_id, device, require_grad):
-            super(OnesModule, self).__init__()
+            super(FillModule, self).__init__()
             self.out_size = out_size
             self.device = device
             self.require_grad = require_grad
             self.dtype = jitid_2_dtype[dtype_id]
 
         def forward(self, *args):
-            return torch.ones(size=self.out_size, dtype=self.dtype, device=self.device, requires_grad=self.require_grad)
+            return fill_func(size=self.out_size, dtype=self.dtype, device=self.device, requires_grad=self.require_grad)
 
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    output_shape = translate_list(inputs[0], speedup)
-    dtype_id = parse_constant(inputs[1], speedup)
-    # layout = parse_constant(inputs[2], speedup)
-    device = parse_constant(inputs[3], speedup)
-    require_grad = parse_constant(inputs[4], speedup)
-    return OnesModule(output_shape, dtype_id, device, require_grad)
+    def fill_python(node, speedup):
+        inputs = _inputs(node)
+        output_shape = translate_list(inputs[0], speedup)
+        dtype_id = parse_constant(inputs[1], speedup)
+        # layout = parse_constant(inputs[2], speedup)
+        device = parse_constant(inputs[3], speedup)
+        require_grad = parse_constant(inputs[4], speedup)
+        return FillModule(output_shape, dtype_id, device, require_grad)
+    return fill_python
 
 
-def zeros_python(node, speedup):
-    class ZerosModule(torch.nn.Module):
-        def __init__(self, out_size, dtype_id, device, require_grad):
-            super(ZerosModule, self).__init__()
-            self.out_size = out_size
-            self.device = device
-            self.require_grad = require_grad
-            self.dtype = jitid_2_dtype[dtype_id]
-
-        def forward(self, *args):
-            return torch.zeros(size=self.out_size, dtype=self.dtype, device=self.device, requires_grad=self.require_grad)
+ones_python = _make_fill_python(torch.ones)
+zeros_python = _make_fill_python(torch.zeros)
 
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
-    output_shape = translate_list(inputs[0], speedup)
-    dtype_id = parse_constant(inputs[1], speedup)
-    # layout = parse_constant(inputs[2], speedup)
-    device = parse_constant(inputs[3], speedup)
-    require_grad = parse_constant(inputs[4], speedup)
-    return ZerosModule(output_shape, dtype_id, device, require_grad)
 
 def rsub_python(node, speedup):
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+    inputs = _inputs(node)
     constant = None
-    other_name = inputs[1].debugName()
+    other_name = _debug_name(inputs[1], speedup)
     alpha = parse_constant(inputs[2], speedup)
     if other_name not in speedup.internal_result:
         constant = parse_constant(inputs[1], speedup)
@@ -690,85 +780,130 @@ def rsub_python(node, speedup):
         new_sub = partial(torch.sub, other=constant, alpha=alpha)
         return new_sub
 
-def expand_python(node, speedup):
-    class ExpandModule(torch.nn.Module):
-        def __init__(self, new_size):
-            super(ExpandModule, self).__init__()
-            # need deepcopy when the input is size-related
-            self.new_size = copy.deepcopy(new_size)
+class _ExpandModule(torch.nn.Module):
+    def __init__(self, new_size):
+        super(_ExpandModule, self).__init__()
+        # need a copy when the input is size-related
+        self.new_size = tuple(new_size)
 
-        def forward(self, *args):
-            return args[0].expand(self.new_size).clone()
+    def forward(self, *args):
+        # the expanded tensor shares the memory with the input and among the
+        # broadcast positions, so materialize it into a new contiguous tensor
+        return args[0].expand(self.new_size).clone(memory_format=torch.contiguous_format)
 
-    c_node = node.key_node
-    inputs = list(c_node.inputs())
+
+def expand_python(node, speedup):
+    inputs = _inputs(node)
     new_size = translate_list(inputs[1], speedup)
-    return ExpandModule(new_size)
+    return _ExpandModule(new_size)
+
+
+class _ExpandasModule(torch.nn.Module):
+    def forward(self, x, y):
+        return x.expand_as(y).clone(memory_format=torch.contiguous_format)
+
+
 def expandas_python(node, speedup):
-    class ExpandasModule(torch.nn.Module):
-        def forward(self, x, y):
-            return x.expand_as(y).clone()
-    return ExpandasModule()
+    return _ExpandasModule()
 
 
+# ordered by how often the ops show up in the typical CNN/transformer graphs,
+# the shape-related ops first and the rarely used ops last
 trans_from_jit_to_python = {
+    'prim::Constant': constant_python,
+    'aten::size': size_python,
+    'aten::Int': toint_python,
+    'aten::view': view_python,
+    'aten::reshape': reshape_python,
     'aten::add': add_python,
     'aten::add_': add_python,
-    'aten::sub': sub_python,
-    'aten::sub_': sub_python,
     'aten::mul': mul_python,
     'aten::mul_': mul_python,
+    'aten::mean': mean_python,
+    'prim::GetAttr': getattr_python,
+    'prim::NumToTensor': num2tensor_python,
     'aten::relu': relu_python,
     'aten::relu_': relu_inplace_python,
-    'aten::sigmoid': sigmoid_python,
-    'aten::sigmoid_': sigmoid_python,
-    # tanh behaives like relu
-    'aten::tanh': relu_python,
-    'aten::tanh_': relu_python,
     'aten::flatten': flatten_python,
-    'aten::mean': mean_python,
-    'aten::dropout': dropout_python,
-    'aten::slice': slice_python,
-    'aten::select': select_python,
-    'aten::size': size_python,
-    'aten::t': transpose_python,
     'aten::transpose': transpose2_python,
-    'aten::Int': toint_python,
-    'aten::view': view_python,
-    'aten::reshape': reshape_python,
     'aten::permute': permute_python,
+    'aten::contiguous': contiguous_python,
     'aten::matmul': matmul_python,
+    'aten::softmax': softmax_python,
     'aten::div': div_python,
     'aten::floor_divide': floor_div_python,
-    'aten::softmax': softmax_python,
-    'aten::contiguous': contiguous_python,
-    'aten::gelu': gelu_python,
+    'aten::sub': sub_python,
+    'aten::sub_': sub_python,
+    'aten::slice': slice_python,
+    'aten::select': select_python,
     'aten::cat': cat_python,
+    'aten::gelu': gelu_python,
+    'aten::silu': silu_python,
+    'aten::sigmoid': sigmoid_python,
+    'aten::sigmoid_': sigmoid_python,
+    # tanh behaives like relu
+    'aten::tanh': relu_python,
+    'aten::tanh_': relu_python,
+    'aten::dropout': dropout_python,
+    'aten::t': transpose_python,
     'aten::avg_pool2d': avgpool2d_python,
     'aten::max_pool2d': avgpool2d_python,
     'aten::adaptive_avg_pool2d': adaptive_avgpool_python,
+    'aten::squeeze': squeeze_python,
+    'aten::unsqueeze': unsqueeze_python,
+    'aten::expand': expand_python,
+    'aten::expand_as': expandas_python,
     'aten::to': to_python,
     'aten::type_as': typeas_python,
-    'aten::upsample_bilinear2d': upsample_bilinear2d_python,
-    'aten::upsample_nearest2d': upsample_nearest2d_python,
     'aten::exp': exp_python,
-    'aten::squeeze': squeeze_python,
-    'aten::unsqueeze': unsqueeze_python,
     'aten::ones': ones_python,
     'aten::zeros': zeros_python,
     'aten::rsub': rsub_python,
-    'aten::expand': expand_python,
     'prim::TupleUnpack': tupleunpack_python,
     'prim::ListUnpack': tupleunpack_python,
-    'prim::NumToTensor': num2tensor_python,
-    'prim::GetAttr': getattr_python,
-    'prim::Constant': constant_python,
-    'aten::constant_pad_nd': constant_pad_nd_python,
-    'aten::silu': silu_python,
-    'aten::expand_as': expandas_python
+    'aten::upsample_bilinear2d': upsample_bilinear2d_python,
+    'aten::upsample_nearest2d': upsample_nearest2d_python,
+    'aten::constant_pad_nd': constant_pad_nd_python
+}
+
+
+# the translated functions of these ops only depend on the constant arguments
+# (all inputs except the first one), and hold no state, so they can be shared
+# among the nodes that have the same arguments. The ops that take a list
+# argument (view, reshape, permute, mean) or an optional dtype (softmax) are
+# not listed, because the ListConstruct/None inputs never have a hashable
+# constant value, so their translations could not be shared anyway.
+_SHARABLE_TRANSLATION_OPS = {
+    'aten::transpose', 'aten::flatten', 'aten::select'
 }
 
 
+def _translation_signature(node, speedup):
+    """
+    Get the key to share the translated function of the target node, return
+    None if the translation cannot be shared.
+    """
+    if node.op_type not in _SHARABLE_TRANSLATION_OPS:
+        return None
+    signature = []
+    for _input in _inputs(node)[1:]:
+        value = _ivalue(_input, speedup)
+        if value is None:
+            # the value is computed by the other nodes, or is a None constant
+            # that we cannot tell apart, so don't share the translation
+            return None
+        if isinstance(value, list):
+            value = tuple(value)
+        # also record the type, because 1 == 1.0 == True
+        signature.append((type(value), value))
+    signature = (node.op_type, tuple(signature))
+    try:
+        hash(signature)
+    except TypeError:
+        return None
+    return signature
+
+
 def jit_to_python_function(node, speedup):
     """
     Return a callable object to inference the mask according to the
@@ -789,9 +924,116 @@ def jit_to_python_function(node, speedup):
     """
     logger.debug(
         'Translate C function %s into its python version', node.op_type)
-    if node.op_type not in trans_from_jit_to_python:
+    if speedup is not None and node.unique_name in speedup.folded_nodes:
+        # the output of this node is already evaluated by fold_constants
+        return None
+    trans_func = trans_from_jit_to_python.get(node.op_type)
+    if trans_func is None:
         logger.error(
             '%s is not Supported! Please report an issue at https://github.com/microsoft/nni. Thanks~', node.op_type)
         # return None to skip the mask inference for this node
         return None
-    return trans_from_jit_to_python[node.op_type](node, speedup)
+    signature = _translation_signature(node, speedup)
+    if signature is None or speedup is None:
+        return trans_func(node, speedup)
+    cache = speedup.translation_cache
+    if signature not in cache:
+        cache[signature] = trans_func(node, speedup)
+    return cache[signature]
+
+
+# the shape-arithmetic ops that can be evaluated before the mask inference
+# once all their inputs are constants
+_FOLDABLE_OPS = {
+    'aten::add', 'aten::sub', 'aten::mul', 'aten::div', 'aten::floor_divide',
+    'aten::size', 'aten::Int', 'prim::NumToTensor'
+}
+
+
+def _static_size(node, speedup):
+    """
+    Get the output of the aten::size node without running it. The shapes of
+    the tensors don't change during the mask inference, so the size can be read
+    from the input tensor if it is already known, or from the traced tensor type.
+    Return None if the size cannot be decided in advance.
+    """
+    inputs = _inputs(node)
+    if len(inputs) < 2:
+        # size() without the dim returns the whole shape
+        return None
+    size_dim = _ivalue(inputs[1], speedup)
+    if not isinstance(size_dim, int):
+        return None
+    tensor = speedup.internal_result.get(_debug_name(inputs[0], speedup))
+    if isinstance(tensor, torch.Tensor):
+        size = tensor.size(size_dim)
+    else:
+        tensor_type = inputs[0].type()
+        if not isinstance(tensor_type, torch._C.TensorType):
+            return None
+        try:
+            sizes = tensor_type.sizes()
+        except RuntimeError:
+            sizes = None
+        if sizes is None or not -len(sizes) <= size_dim < len(sizes):
+            return None
+        size = sizes[size_dim]
+    return torch.as_tensor([size], dtype=torch.long)
+
+
+def fold_constants(nodes, speedup):
+    """
+    Evaluate the shape-arithmetic nodes before the mask inference. The aten::size
+    nodes are folded when the shape of their input is known in advance, and the
+    arithmetic nodes (add/mul/NumToTensor/Int, ...) are folded when all their
+    inputs are the outputs of the already folded nodes, e.g., the chain
+    size -> NumToTensor -> mul -> Int that computes the argument of a view. The
+    scalar outputs are put into speedup.internal_result together with the masks
+    and constants given by AutoMaskInference.isconstants. The masks are the same
+    as the ones the mask inference would get by running these nodes. The constants
+    are the real values, while the mask inference would get 0 for the nodes after
+    the aten::size, because apply_mask zeroes their masked scalar inputs (the
+    constants are not read by the successors). jit_to_python_function returns None
+    for the folded nodes, so no wrapper is built and run for them.
+
+    Parameters
+    ----------
+    nodes: list of NodePyGroup
+        The nodes of the graph in the topological order.
+    speedup: ModelSpeedup
+        The speedup object of the target model.
+
+    Returns
+    -------
+    folded: set of str
+        The unique names of all the folded nodes.
+    """
+    folded = speedup.folded_nodes
+    folded_outputs = set()
+    for node in nodes:
+        if node.type != 'func' or node.op_type not in _FOLDABLE_OPS or len(node.outputs) != 1:
+            continue
+        if node.op_type == 'aten::size':
+            value = _static_size(node, speedup)
+        elif all(name in folded_outputs for name in node.inputs):
+            func = jit_to_python_function(node, speedup)
+            if func is None:
+                continue
+            try:
+                with torch.no_grad():
+                    value = func(*[speedup.internal_result[name] for name in node.inputs])
+            except Exception as err:  # pylint: disable=broad-except
+                logger.debug('Cannot fold %s: %s', node.unique_name, err)
+                continue
+        else:
+            continue
+        if not isinstance(value, torch.Tensor) or value.numel() != 1:
+            continue
+        out_debugname = node.outputs[0]
+        speedup.internal_result[out_debugname] = value
+        speedup.masks[out_debugname], speedup.constant[out_debugname] = \
+            AutoMaskInference.isconstants(value.clone().detach())
+        folded_outputs.add(out_debugname)
+        folded.add(node.unique_name)
+        logger.debug('Fold %s into the constant %s', node.unique_name, str(value))
+    return folded
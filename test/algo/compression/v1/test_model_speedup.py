@@ -16,8 +16,10 @@ from torchvision.models.resnet import resnet18
 from torchvision.models.mobilenet import mobilenet_v2
 import unittest
 from unittest import TestCase, main
+from unittest.mock import patch
 
 from nni.compression.pytorch import ModelSpeedup, apply_compression_results
+from nni.compression.pytorch.speedup.jit_translate import fold_constants, jit_to_python_function
 from nni.algorithms.compression.pytorch.pruning import L1FilterPruner, LevelPruner
 from nni.algorithms.compression.pytorch.pruning.weight_masker import WeightMasker
 from nni.algorithms.compression.pytorch.pruning.dependency_aware_pruner import DependencyAwarePruner
@@ -552,6 +554,119 @@ class SpeedupTestCase(TestCase):
         ms=ModelSpeedup(model, im, MASK_FILE)
         ms.speedup_model()
 
+    def test_shared_translation(self):
+        """The identical stateless nodes should share one translated function."""
+        class Net(torch.nn.Module):
+            def __init__(self):
+                super(Net, self).__init__()
+                self.conv1 = torch.nn.Conv2d(3, 8, 3)
+                self.conv2 = torch.nn.Conv2d(8, 8, 3)
+
+            def forward(self, x):
+                x = self.conv1(x).transpose(1, 2)
+                return self.conv2(x.transpose(1, 2)).transpose(2, 3)
+
+        model = Net()
+        dummy_input = torch.rand(2, 3, 16, 16)
+        ms = ModelSpeedup(model, dummy_input, {})
+        funcs = [jit_to_python_function(node, ms) for node in ms.torch_graph.nodes_py.nodes_op
+                 if node.op_type == 'aten::transpose']
+        assert len(funcs) == 3
+        assert funcs[0] is funcs[1]
+        assert funcs[0] is not funcs[2]
+        out = funcs[0](dummy_input)
+        assert torch.equal(out, dummy_input.transpose(1, 2))
+
+    def test_sub_constant_speedup(self):
+        """The constant operand of aten::sub should stay on its own side"""
+        class Net(torch.nn.Module):
+            def __init__(self):
+                super(Net, self).__init__()
+                self.conv1 = torch.nn.Conv2d(3, 8, 3)
+                self.conv2 = torch.nn.Conv2d(8, 8, 3)
+                # a plain tensor attribute is traced into a prim::Constant
+                self.constant = torch.tensor(3.0)
+
+            def forward(self, x):
+                x = self.conv1(x)
+                # the pruned channels of x stay zero after the multiplication
+                return self.conv2((self.constant - x) * x * (x - self.constant))
+
+        model = Net()
+        dummy_input = torch.rand(2, 3, 16, 16)
+        pruner = L1FilterPruner(model, [{'op_names': ['conv1'], 'sparsity': 0.5}])
+        pruner.compress()
+        pruner.export_model(MODEL_FILE, MASK_FILE)
+        pruner._unwrap_model()
+        model.load_state_dict(torch.load(MODEL_FILE))
+        ori_out = model(dummy_input)
+        ms = ModelSpeedup(model, dummy_input, MASK_FILE)
+        funcs = [jit_to_python_function(node, ms) for node in ms.torch_graph.nodes_py.nodes_op
+                 if node.op_type == 'aten::sub']
+        assert len(funcs) == 2
+        x = torch.rand(2, 8, 14, 14)
+        assert torch.equal(funcs[0](x), 3.0 - x)
+        assert torch.equal(funcs[1](x), x - 3.0)
+        ms.speedup_model()
+        assert model.conv1.out_channels == 4
+        assert torch.allclose(model(dummy_input), ori_out, atol=ABSOLUTE_THRESHOLD)
+
+    def test_fold_constants(self):
+        """The size -> NumToTensor -> mul -> Int chain should be folded into constants"""
+        class Net(torch.nn.Module):
+            def forward(self, x):
+                return x.view(x.size(0) * 2, -1)
+
+        dummy_input = torch.rand(2, 4, 4, 4)
+        ms = ModelSpeedup(Net(), dummy_input, {}, confidence=8)
+        folded = fold_constants(ms.torch_graph.nodes_py.nodes_op, ms)
+        folded_types = [ms.torch_graph.name_to_node[name].op_type for name in folded]
+        assert sorted(folded_types) == ['aten::Int', 'aten::mul', 'aten::size']
+        for node in ms.torch_graph.nodes_py.nodes_op:
+            if node.op_type == 'aten::view':
+                assert node.unique_name not in folded
+                continue
+            # the batch size of the dummy input is replaced by the confidence
+            out_debugname = node.outputs[0]
+            expected = 8 if node.op_type == 'aten::size' else 16
+            assert ms.internal_result[out_debugname].item() == expected
+            # the masks are the ones the mask inference gives to the integers,
+            # while the constants keep the folded values instead of the zeros
+            # the mask inference would get from the masked inputs
+            assert torch.sum(ms.masks[out_debugname]) == 0
+            assert torch.equal(ms.constant[out_debugname], ms.internal_result[out_debugname])
+            assert jit_to_python_function(node, ms) is None
+
+    def test_fold_constants_masks(self):
+        """The constant folding should not change the inferred masks"""
+        for model_cls, dummy_input in [(BackboneModel2, torch.rand(2, 1, 28, 28)),
+                                       (TransposeModel, torch.rand(2, 3, 8, 8))]:
+            ori_model = model_cls()
+            config_list = [{'sparsity': 0.5, 'op_types': ['Conv2d']}]
+            pruner = L1FilterPruner(ori_model, config_list)
+            pruner.compress()
+            ori_model(dummy_input)
+            pruner.export_model(MODEL_FILE, MASK_FILE)
+            pruner._unwrap_model()
+            masks = []
+            for fold in (True, False):
+                model = model_cls()
+                model.load_state_dict(torch.load(MODEL_FILE))
+                torch.manual_seed(0)
+                ms = ModelSpeedup(model, dummy_input, MASK_FILE, confidence=8)
+                if fold:
+                    ms.speedup_model()
+                    assert len(ms.folded_nodes) > 0
+                else:
+                    with patch('nni.compression.pytorch.speedup.compressor.fold_constants'):
+                        ms.speedup_model()
+                    assert len(ms.folded_nodes) == 0
+                masks.append(ms.masks)
+            folded_masks, unfolded_masks = masks
+            for name, mask in unfolded_masks.items():
+                if isinstance(mask, torch.Tensor):
+                    assert torch.equal(folded_masks[name], mask), name
+
     def tearDown(self):
         if os.path.exists(MODEL_FILE):
             os.remove(MODEL_FILE)